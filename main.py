@@ -1,17 +1,29 @@
+import functools
 import json
 from dotenv import load_dotenv
 from slugify import slugify
 import os
 import re
 import sys
+import time
+import threading
 import requests
 import warnings
 import logging
+import logging.handlers
+import atexit
+import cProfile
+import queue
 import pynetbox
 import ipaddress
 import yaml
+from types import MappingProxyType
+from collections import defaultdict
+from dataclasses import dataclass
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from urllib3.exceptions import InsecureRequestWarning
+from urllib3.util.retry import Retry
+from pynetbox.core.response import Record
 # Import the unifi module instead of defining the Unifi class
 from unifi.unifi import Unifi
 # Suppress only the InsecureRequestWarning
@@ -23,25 +35,72 @@ logger = logging.getLogger(__name__)
 # Define threads for each layer
 MAX_CONTROLLER_THREADS = 5  # Number of UniFi controllers to process concurrently
 MAX_SITE_THREADS = 8  # Number of sites to process concurrently per controller
-MAX_DEVICE_THREADS = 8  # Number of devices to process concurrently per site
 MAX_THREADS = 8 # Define threads based on available system cores or default
+# Every worker thread may hold a NetBox connection, so size the pool for all of them
+NETBOX_POOL_SIZE = MAX_CONTROLLER_THREADS * MAX_SITE_THREADS
 
-def get_postable_fields(base_url, token, url_path):
+# Device types by model, shared by all workers, see get_device_type()
+_device_types = {}
+_device_type_locks = defaultdict(threading.Lock)
+_device_type_locks_guard = threading.Lock()
+# Serializes the first lookup of the Ubiquity manufacturer, see get_or_create_ubiquity()
+_ubiquity_lock = threading.Lock()
+
+# Use the libyaml-based safe loader when PyYAML was built with it, it is much faster than the pure-Python one
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# Page size for bulk NetBox queries. 1000 is NetBox's default MAX_PAGE_SIZE; a server with a lower limit
+# caps the page size itself and pynetbox follows the pagination links as usual.
+NETBOX_PAGE_SIZE = 1000
+
+# Profile output written when UNIFI2NETBOX_PROFILE=1, see start_profiler()
+PROFILE_FILE = "prof.out"
+
+# On-disk cache of the NetBox sites, see load_sites_cached()
+SITES_CACHE_FILE = os.path.expanduser("~/.cache/unifi2netbox/sites.json")
+SITES_CACHE_TTL = 3600  # Seconds before the cached sites are fetched from NetBox again
+
+# Size at which a log file is rotated, and the number of rotated files to keep
+LOG_MAX_BYTES = 50 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+
+# Log entries written when a device or IP address is created, used by parse_successful_log_entries()
+SUCCESS_LOG_PATTERN = re.compile(r"INFO - (Device|IP address) .* with ID (\d+) successfully added to NetBox")
+
+@dataclass(frozen=True, slots=True)
+class NetBoxContext:
+    """
+    NetBox objects that stay the same for the whole run. They are resolved once at startup and
+    passed down to the controller, site and device workers.
+
+    :ivar wireless_role: Device role for UniFi access points
+    :ivar lan_role: Device role for all other UniFi devices
+    :ivar tenant: Tenant of the created devices and IP addresses
+    :ivar role_field: Name of the device role field in the NetBox API, 'role' or 'device_role'
+    """
+    wireless_role: Record
+    lan_role: Record
+    tenant: Record
+    role_field: str
+
+def get_postable_fields(session, base_url, token, url_path):
     """
     Retrieves the POST-able fields for NetBox path.
+
+    :param session: requests.Session to send the request with, so the pooled NetBox connection is reused.
     """
     url = f"{base_url}/api/{url_path}/"
-    logger.debug(f"Retrieving POST-able fields from NetBox API: {url}")
+    logger.debug("Retrieving POST-able fields from NetBox API: %s", url)
     headers = {
         "Authorization": f"Token {token}",
         "Content-Type": "application/json",
     }
-    response = requests.options(url, headers=headers, verify=False)
+    response = session.options(url, headers=headers)
     response.raise_for_status()  # Raise an error if the response is not successful
 
     # Extract the available POST fields from the API schema
     fields = response.json().get("actions", {}).get("POST", {})
-    logger.debug(f"Retrieved {len(fields)} POST-able fields from NetBox API")
+    logger.debug("Retrieved %s POST-able fields from NetBox API", len(fields))
     return fields
 
 def load_site_mapping(config=None):
@@ -61,7 +120,7 @@ def load_site_mapping(config=None):
         config_mappings = config['UNIFI']['SITE_MAPPINGS']
         if config_mappings:
             site_mapping.update(config_mappings)
-            logger.debug(f"Loaded {len(config_mappings)} site mappings from config.yaml")
+            logger.debug("Loaded %s site mappings from config.yaml", len(config_mappings))
     
     # Check if we should use the external mapping file
     use_file_mapping = False
@@ -70,11 +129,11 @@ def load_site_mapping(config=None):
         
     if use_file_mapping:
         site_mapping_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config', 'site_mapping.yaml')
-        logger.debug(f"Loading site mapping from file: {site_mapping_path}")
+        logger.debug("Loading site mapping from file: %s", site_mapping_path)
         
         # Check if file exists, if not create a default one
         if not os.path.exists(site_mapping_path):
-            logger.warning(f"Site mapping file not found at {site_mapping_path}. Creating a default one.")
+            logger.warning("Site mapping file not found at %s. Creating a default one.", site_mapping_path)
             os.makedirs(os.path.dirname(site_mapping_path), exist_ok=True)
             with open(site_mapping_path, 'w') as f:
                 f.write("# Site mapping configuration\n")
@@ -83,70 +142,169 @@ def load_site_mapping(config=None):
             
         try:
             with open(site_mapping_path, 'r') as f:
-                file_mapping = yaml.safe_load(f) or {}
-                logger.debug(f"Loaded {len(file_mapping)} mappings from site_mapping.yaml")
+                file_mapping = yaml.load(f, Loader=YAML_LOADER) or {}
+                logger.debug("Loaded %s mappings from site_mapping.yaml", len(file_mapping))
                 # Update the mapping with file values (config values take precedence)
                 for key, value in file_mapping.items():
                     if key not in site_mapping:  # Don't overwrite config mappings
                         site_mapping[key] = value
         except Exception as e:
-            logger.error(f"Error loading site mapping file: {e}")
+            logger.error("Error loading site mapping file: %s", e)
     
-    logger.debug(f"Final site mapping has {len(site_mapping)} entries")
+    logger.debug("Final site mapping has %s entries", len(site_mapping))
     return site_mapping
 
-def get_netbox_site_name(unifi_site_name, config=None):
+def get_netbox_site_name(unifi_site_name, site_mapping=None):
     """
     Get NetBox site name from UniFi site name using the mapping table.
     If no mapping exists, return the original name.
     
     :param unifi_site_name: The UniFi site name to look up
-    :param config: Configuration dictionary loaded from config.yaml
+    :param site_mapping: Site mapping dictionary as returned by load_site_mapping()
     :return: The corresponding NetBox site name or the original name if no mapping exists
     """
-    site_mapping = load_site_mapping(config)
+    site_mapping = site_mapping or {}
     mapped_name = site_mapping.get(unifi_site_name, unifi_site_name)
     if mapped_name != unifi_site_name:
-        logger.debug(f"Mapped UniFi site '{unifi_site_name}' to NetBox site '{mapped_name}'")
+        logger.debug("Mapped UniFi site '%s' to NetBox site '%s'", unifi_site_name, mapped_name)
     return mapped_name
 
+def normalize_site_name(name):
+    """Normalize a site name for case-insensitive lookups in the NetBox sites dictionary.
+
+    Uses str.casefold() rather than str.lower() so that caseless matching is also correct for
+    non-ASCII names (e.g. "Straße" and "STRASSE").
+    """
+    return name.strip().casefold()
+
 def prepare_netbox_sites(netbox_sites):
     """
     Pre-process NetBox sites for lookup.
 
+    The keys are normalized with normalize_site_name() so that lookups are case-insensitive. The
+    dictionary is shared by all worker threads and is therefore returned as a read-only mapping.
+
     :param netbox_sites: List of NetBox site objects.
-    :return: A dictionary mapping NetBox site names to the original NetBox site objects.
+    :return: A read-only mapping of normalized NetBox site names to the original NetBox site objects.
     """
-    netbox_sites_dict = {}
-    for netbox_site in netbox_sites:
-        netbox_sites_dict[netbox_site.name] = netbox_site
-    return netbox_sites_dict
+    return MappingProxyType({normalize_site_name(netbox_site.name): netbox_site for netbox_site in netbox_sites})
 
-def match_sites_to_netbox(ubiquity_desc, netbox_sites_dict, config=None):
+def get_sites_stamp(sites_endpoint):
+    """
+    Get a cheap fingerprint of the NetBox sites with a single one-item request.
+
+    Adding, changing or deleting a site changes either the number of sites or the newest
+    `last_updated` timestamp, so an unchanged stamp means a cached copy of the sites is still valid.
+
+    :param sites_endpoint: pynetbox endpoint of the NetBox sites.
+    :return: A list with the number of sites and the newest `last_updated` timestamp.
+    """
+    newest = sites_endpoint.filter(ordering="-last_updated", limit=1, offset=0)
+    count = len(newest)
+    newest_site = next(newest, None)
+    return [count, newest_site.last_updated if newest_site else None]
+
+def load_sites_cached(nb, path=SITES_CACHE_FILE, ttl=SITES_CACHE_TTL, refresh=False):
+    """
+    Get all NetBox sites, using an on-disk cache.
+
+    Within `ttl` the cache is used as is. Once it is older, it is revalidated with a single
+    one-item request (see get_sites_stamp()) and only refetched when the sites have changed.
+
+    The cache records the base URL of the NetBox instance and is ignored when running against a
+    different instance.
+
+    Only the fields needed for site matching (id, name, slug and tenant_id) are kept, both in the
+    cache and in the returned sites, whether they come from the cache or from NetBox. The sites are
+    returned as pynetbox records built from these fields.
+
+    :param nb: pynetbox API instance.
+    :param path: Path of the cache file.
+    :param ttl: Maximum age of the cache file in seconds before it is revalidated.
+    :param refresh: Ignore the cache and fetch the sites from NetBox.
+    :return: List of NetBox site objects.
+    """
+    sites_endpoint = nb.dcim.sites
+    cache = None
+    if not refresh and os.path.exists(path):
+        try:
+            with open(path, "r") as f:
+                cache = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning("Could not read NetBox sites cache %s: %s", path, e)
+        if not isinstance(cache, dict) or "sites" not in cache:
+            cache = None
+        elif cache.get("base_url") != nb.base_url:
+            # Site IDs are only valid for the NetBox instance they were fetched from
+            logger.debug("NetBox sites cache %s belongs to another NetBox instance, ignoring it", path)
+            cache = None
+
+    stamp = None
+    if cache is not None:
+        fresh = time.time() - os.path.getmtime(path) < ttl
+        if not fresh:
+            stamp = get_sites_stamp(sites_endpoint)
+            if stamp == cache.get("stamp"):
+                logger.debug("NetBox sites are unchanged, revalidated cache %s", path)
+                try:
+                    os.utime(path)
+                except OSError as e:
+                    logger.warning("Could not update NetBox sites cache %s: %s", path, e)
+                fresh = True
+        if fresh:
+            logger.debug("Loaded %s NetBox sites from cache %s", len(cache["sites"]), path)
+            return [sites_endpoint.return_obj(site, nb, sites_endpoint) for site in cache["sites"]]
+
+    # Take the stamp before fetching, so changes made during the fetch invalidate the cache next time
+    if stamp is None:
+        stamp = get_sites_stamp(sites_endpoint)
+    # Keep only the cached fields of each site, the full records are dropped while iterating
+    logger.debug("Fetching all NetBox sites")
+    cache = {
+        "base_url": nb.base_url,
+        "stamp": stamp,
+        "sites": [{
+            "id": site.id,
+            "name": site.name,
+            "slug": site.slug,
+            "tenant_id": site.tenant.id if site.tenant else None,
+        } for site in sites_endpoint.all(limit=NETBOX_PAGE_SIZE)],
+    }
+    try:
+        # Write to a temporary file first so a concurrent run never reads a partial cache
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(cache, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning("Could not write NetBox sites cache %s: %s", path, e)
+    return [sites_endpoint.return_obj(site, nb, sites_endpoint) for site in cache["sites"]]
+
+def match_sites_to_netbox(ubiquity_desc, netbox_sites_dict, site_mapping=None):
     """
     Match Ubiquity site to NetBox site using the site mapping configuration.
 
     :param ubiquity_desc: The description of the Ubiquity site.
-    :param netbox_sites_dict: A dictionary mapping NetBox site names to site objects.
-    :param config: Configuration dictionary loaded from config.yaml
+    :param netbox_sites_dict: A dictionary mapping NetBox site names to site objects, as returned by prepare_netbox_sites().
+    :param site_mapping: Site mapping dictionary as returned by load_site_mapping()
     :return: The matched NetBox site, or None if no match is found.
     """
     # Get the corresponding NetBox site name from the mapping
-    netbox_site_name = get_netbox_site_name(ubiquity_desc, config)
-    logger.debug(f'Mapping Ubiquity site: "{ubiquity_desc}" -> "{netbox_site_name}"')
+    netbox_site_name = get_netbox_site_name(ubiquity_desc, site_mapping)
+    logger.debug('Mapping Ubiquity site: "%s" -> "%s"', ubiquity_desc, netbox_site_name)
     
-    # Look for exact match in NetBox sites
-    if netbox_site_name in netbox_sites_dict:
-        netbox_site = netbox_sites_dict[netbox_site_name]
-        logger.debug(f'Matched Ubiquity site "{ubiquity_desc}" to NetBox site "{netbox_site.name}"')
+    # Look for a (case-insensitive) match in NetBox sites
+    netbox_site = netbox_sites_dict.get(normalize_site_name(netbox_site_name))
+    if netbox_site is not None:
+        logger.debug('Matched Ubiquity site "%s" to NetBox site "%s"', ubiquity_desc, netbox_site.name)
         return netbox_site
     
     # If site mapping is enabled but no match found, provide more helpful message
-    if config and 'UNIFI' in config and ('USE_SITE_MAPPING' in config['UNIFI'] and config['UNIFI']['USE_SITE_MAPPING'] or 
-                                        'SITE_MAPPINGS' in config['UNIFI'] and config['UNIFI']['SITE_MAPPINGS']):
-        logger.debug(f'No match found for Ubiquity site "{ubiquity_desc}". Add mapping in config.yaml or site_mapping.yaml.')
+    if site_mapping:
+        logger.debug('No match found for Ubiquity site "%s". Add mapping in config.yaml or site_mapping.yaml.', ubiquity_desc)
     else:
-        logger.debug(f'No match found for Ubiquity site "{ubiquity_desc}". Enable site mapping in config.yaml if needed.')
+        logger.debug('No match found for Ubiquity site "%s". Enable site mapping in config.yaml if needed.', ubiquity_desc)
     return None
 
 def setup_logging(min_log_level=logging.INFO):
@@ -155,7 +313,11 @@ def setup_logging(min_log_level=logging.INFO):
     Only logs from the specified `min_log_level` and above are saved in their respective files.
     Includes console logging for the same log levels.
 
+    Records are handed to a queue and written by a background listener thread, so the worker
+    threads never wait on file or console I/O. The log files are rotated when they grow too large.
+
     :param min_log_level: Minimum log level to log. Defaults to logging.INFO.
+    :return: The started QueueListener. It is stopped automatically when the program exits.
     """
     logs_dir = "logs"
     if not os.path.exists(logs_dir):
@@ -173,333 +335,639 @@ def setup_logging(min_log_level=logging.INFO):
         "CRITICAL": logging.CRITICAL
     }
 
-    # Create the root logger
+    # Create the root logger. Records below `min_log_level` are dropped before they are even created.
     logger = logging.getLogger()
-    logger.setLevel(logging.DEBUG)  # Capture all log levels
+    logger.setLevel(min_log_level)
 
     # Define a log format
     log_format = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
 
     # Set up file handlers for each log level
+    handlers = []
     for level_name, level_value in log_levels.items():
         if level_value >= min_log_level:
             log_file = os.path.join(logs_dir, f"{level_name.lower()}.log")
-            handler = logging.FileHandler(log_file)
+            handler = logging.handlers.RotatingFileHandler(log_file, maxBytes=LOG_MAX_BYTES,
+                                                           backupCount=LOG_BACKUP_COUNT)
             handler.setLevel(level_value)
             handler.setFormatter(log_format)
 
             # Add a filter so only logs of this specific level are captured
             handler.addFilter(lambda record, lv=level_value: record.levelno == lv)
-            logger.addHandler(handler)
+            handlers.append(handler)
 
     # Set up console handler for logs at `min_log_level` and above
     console_handler = logging.StreamHandler()
     console_handler.setLevel(min_log_level)
     console_handler.setFormatter(log_format)
-    logger.addHandler(console_handler)
+    handlers.append(console_handler)
 
-    logging.info(f"Logging is set up. Minimum log level: {logging.getLevelName(min_log_level)}")
+    # Hand records to the listener thread, which passes them on to the file and console handlers
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
 
+    logging.info("Logging is set up. Minimum log level: %s", logging.getLevelName(min_log_level))
+    return listener
+
+def start_profiler(path=PROFILE_FILE):
+    """
+    Profile the run with cProfile and write the stats to `path` when the process exits.
+
+    On Python 3.12 and later cProfile is built on sys.monitoring, so the profiler enabled here also
+    records the worker threads of the controller, site and startup pools.
+
+    Inspect the stats with e.g. `python -m pstats prof.out`.
+
+    :param path: Path of the profile stats file.
+    :return: The running profiler.
+    """
+    profiler = cProfile.Profile()
+
+    def stop_profiler():
+        profiler.disable()
+        profiler.dump_stats(path)
+        logger.info("Profile written to %s", path)
+
+    atexit.register(stop_profiler)
+    profiler.enable()
+    return profiler
+
+@functools.lru_cache(maxsize=1)
 def load_config(config_path="config/config.yaml"):
     """
     Reads the configuration from a YAML file.
+    The parsed configuration is cached, so repeated calls do not re-read the file.
 
     :param config_path: Path to the YAML configuration file.
     :return: A dictionary of the configuration.
     """
     if not os.path.exists(config_path):
         raise FileNotFoundError(f"Configuration file not found: {config_path}")
+    if not yaml.__with_libyaml__:
+        logger.warning("PyYAML is installed without libyaml, falling back to the slower pure-Python YAML loader.")
 
     with open(config_path, "r") as file:
         try:
-            config = yaml.safe_load(file)  # Use safe_load to avoid executing malicious YAML code
+            config = yaml.load(file, Loader=YAML_LOADER)  # Use a safe loader to avoid executing malicious YAML code
             return config
         except yaml.YAMLError as e:
             raise Exception(f"Error reading configuration file: {e}")
 
-def process_device(unifi, nb, site, device, nb_ubiquity, tenant):
-    """Process a device and add it to NetBox."""
-    try:
-        logger.info(f"Processing device {device['name']} at site {site}...")
-        logger.debug(f"Device details: Model={device.get('model')}, MAC={device.get('mac')}, IP={device.get('ip')}, Serial={device.get('serial')}")
+@functools.lru_cache(maxsize=4096)
+def _parse_ip(address):
+    """Parse an IP address string, caching the result. Raises ValueError for invalid addresses."""
+    return ipaddress.ip_address(address)
 
-        # Determine device role
-        if str(device.get("is_access_point", "false")).lower() == "true":
-            nb_device_role = wireless_role
+@functools.lru_cache(maxsize=4096)
+def _parse_network(prefix):
+    """Parse a prefix string such as '10.0.0.0/24', caching the result."""
+    return ipaddress.ip_network(prefix)
+
+def find_prefix_for_ip(device_ip, networks):
+    """
+    Find the most specific prefix that contains an IP address without querying NetBox.
+
+    :param device_ip: ipaddress.IPv4Address or IPv6Address to look up.
+    :param networks: List of ipaddress networks sorted from longest to shortest prefix length,
+                     as loaded by load_site_lookups().
+    :return: The containing ipaddress network, or None if no prefix contains the address.
+    """
+    return next((network for network in networks if device_ip in network), None)
+
+def get_site_vrf(nb, site):
+    """
+    Get the VRF for a NetBox site, creating it if it does not exist yet.
+
+    :param nb: pynetbox API instance.
+    :param site: NetBox site object.
+    :return: The NetBox VRF object, or None if it could not be retrieved.
+    """
+    vrfs_endpoint = nb.ipam.vrfs
+    vrf_name = f"vrf_{site}"
+    vrf = None
+    logger.debug("Checking for existing VRF: %s", vrf_name)
+    try:
+        vrf = vrfs_endpoint.get(name=vrf_name)
+    except ValueError as e:
+        error_message = str(e)
+        if "get() returned more than one result." in error_message:
+            logger.warning("Multiple VRFs with name %s found. Using 1st one in the list.", vrf_name)
+            vrfs = vrfs_endpoint.filter(name=vrf_name)
+            for vrf_item in vrfs:
+                vrf = vrf_item
+                break
         else:
-            nb_device_role = lan_role
+            logger.exception("Failed to get VRF %s for site %s: %s.", vrf_name, site, e)
+            return None
 
-        if not device.get("serial"):
-            logger.warning(f"Missing serial number for device {device.get('name')}. Skipping...")
-            return
+    if not vrf:
+        logger.debug("VRF %s not found, creating new VRF", vrf_name)
+        vrf = vrfs_endpoint.create({"name": vrf_name})
+        if vrf:
+            logger.info("VRF %s with ID %s successfully added to NetBox.", vrf_name, vrf.id)
+    return vrf
 
-        # VRF creation
-        vrf_name = f"vrf_{site}"
-        vrf = None
-        logger.debug(f"Checking for existing VRF: {vrf_name}")
-        try:
-            vrf = nb.ipam.vrfs.get(name=vrf_name)
-        except ValueError as e:
-            error_message = str(e)
-            if "get() returned more than one result." in error_message:
-                logger.warning(f"Multiple VRFs with name {vrf_name} found. Using 1st one in the list.")
-                vrfs = nb.ipam.vrfs.filter(name=vrf_name)
-                for vrf_item in vrfs:
-                    vrf = vrf_item
-                    break
-            else:
-                logger.exception(f"Failed to get VRF {vrf_name} for site {site}: {e}. Skipping...")
-                return
+def load_site_lookups(nb, site, tenant, devices):
+    """
+    Fetch the NetBox objects needed to process the devices of a site in bulk, so that
+    prepare_device() only has to do dictionary lookups instead of one GET per device.
+
+    The existing device serials are always fetched. The site VRF (created if missing), its prefixes
+    and IP addresses are only needed to add devices, so they are only loaded if at least one of the
+    UniFi devices is not in NetBox yet.
+
+    :param nb: pynetbox API instance.
+    :param site: NetBox site object.
+    :param tenant: NetBox tenant object.
+    :param devices: The UniFi devices of the site.
+    :return: A dictionary with the set of existing device serials and, if any device is new, the site
+             VRF, the VRF prefixes as networks (longest prefix first) and existing IP addresses by
+             address, or None if the VRF is unavailable.
+    """
+    logger.debug("Fetching existing NetBox devices for site %s", site)
+    serials = {d.serial for d in nb.dcim.devices.filter(site_id=site.id, limit=NETBOX_PAGE_SIZE) if d.serial}
+    site_lookups = {"serials": serials}
+    if not any(device.get("serial") and device["serial"] not in serials for device in devices):
+        logger.debug("No new devices at site %s, skipping VRF, prefix and IP lookups", site)
+        return site_lookups
+
+    vrf = get_site_vrf(nb, site)
+    if not vrf:
+        return None
+
+    logger.debug("Fetching existing NetBox prefixes and IP addresses for site %s", site)
+    site_lookups.update({
+        "vrf": vrf,
+        "prefixes": sorted((_parse_network(p.prefix)
+                            for p in nb.ipam.prefixes.filter(vrf_id=vrf.id, limit=NETBOX_PAGE_SIZE)),
+                           key=lambda network: network.prefixlen, reverse=True),
+        "ip_addresses": {ip.address: ip for ip in nb.ipam.ip_addresses.filter(vrf_id=vrf.id, tenant_id=tenant.id,
+                                                                               limit=NETBOX_PAGE_SIZE)},
+    })
+    return site_lookups
+
+def get_or_create_device_roles(nb, role_names):
+    """
+    Get NetBox device roles by name, creating the missing ones.
+
+    All roles are looked up with a single request and the missing ones are created with a single
+    bulk request, so when all roles exist this costs one request.
+
+    :param nb: pynetbox API instance.
+    :param role_names: Names of the device roles.
+    :return: A dictionary of role names to NetBox device roles.
+    """
+    roles_endpoint = nb.dcim.device_roles
+    slugs = {name: name.lower() for name in role_names}
+    roles_by_slug = {role.slug: role for role in roles_endpoint.filter(slug=list(set(slugs.values())))}
+    missing_roles = {slug: {'name': name, 'slug': slug} for name, slug in slugs.items() if slug not in roles_by_slug}
+    if missing_roles:
+        for role in roles_endpoint.create(list(missing_roles.values())):
+            roles_by_slug[role.slug] = role
+            logger.info("Device role %s with ID %s successfully added to Netbox.", role.name, role.id)
+    return {name: roles_by_slug[slug] for name, slug in slugs.items()}
+
+@functools.lru_cache(maxsize=1)
+def get_or_create_ubiquity(nb):
+    """
+    Get the Ubiquity manufacturer from NetBox, creating it if it does not exist yet.
+
+    The manufacturer is only needed when a device type has to be looked up, so it is resolved on
+    first use instead of at startup and then cached for the rest of the run.
+
+    :param nb: pynetbox API instance.
+    :return: The NetBox manufacturer.
+    """
+    manufacturers_endpoint = nb.dcim.manufacturers
+    with _ubiquity_lock:
+        nb_ubiquity = manufacturers_endpoint.get(slug='ubiquity')
+        if not nb_ubiquity:
+            nb_ubiquity = manufacturers_endpoint.create({'name': 'Ubiquity Networks', 'slug': 'ubiquity'})
+            if nb_ubiquity:
+                logger.info("Ubiquity manufacturer with ID %s successfully added to Netbox.", nb_ubiquity.id)
+        return nb_ubiquity
+
+def get_device_type(nb, device, site):
+    """
+    Get the NetBox device type for the model of a UniFi device, creating it with its interface
+    templates if it does not exist yet.
+
+    Device types are cached for the whole run. Concurrent workers asking for the same model wait
+    for the first one to resolve it instead of racing to create the same device type.
 
-        if not vrf:
-            logger.debug(f"VRF {vrf_name} not found, creating new VRF")
-            vrf = nb.ipam.vrfs.create({"name": vrf_name})
-            if vrf:
-                logger.info(f"VRF {vrf_name} with ID {vrf.id} successfully added to NetBox.")
+    :return: The NetBox device type, or None if it could not be created.
+    """
+    key = device["model"]
+    with _device_type_locks_guard:
+        lock = _device_type_locks[key]
+    with lock:
+        if key in _device_types:
+            return _device_types[key]
+
+        try:
+            nb_ubiquity = get_or_create_ubiquity(nb)
+        except pynetbox.core.query.RequestError as e:
+            logger.error("Failed to get or create the Ubiquity manufacturer: %s", e)
+            return None
 
-        # Device Type creation
-        logger.debug(f"Checking for existing device type: {device['model']} (manufacturer ID: {nb_ubiquity.id})")
+        logger.debug("Checking for existing device type: %s (manufacturer ID: %s)", device['model'], nb_ubiquity.id)
         nb_device_type = nb.dcim.device_types.get(model=device["model"], manufacturer_id=nb_ubiquity.id)
         if not nb_device_type:
             try:
                 nb_device_type = nb.dcim.device_types.create({"manufacturer": nb_ubiquity.id, "model": device["model"],
                                                               "slug": slugify(f'{nb_ubiquity.name}-{device["model"]}')})
                 if nb_device_type:
-                    logger.info(f"Device type {device['model']} with ID {nb_device_type.id} successfully added to NetBox.")
+                    logger.info("Device type %s with ID %s successfully added to NetBox.", device['model'], nb_device_type.id)
             except pynetbox.core.query.RequestError as e:
-                logger.error(f"Failed to create device type for {device['name']} at site {site}: {e}")
-                return
-            if len(device.get("port_table", [])) > 0:
-                for port in device["port_table"]:
-                    if port["media"] == "GE":
-                        port_type = "1000base-t"
-                        try:
-                            template = nb.dcim.interface_templates.create({
-                                "device_type": nb_device_type.id,
-                                "name": port["name"],
-                                "type": port_type,
-                            })
-                            if template:
-                                logger.info(f"Interface template {port['name']} with ID {template.id} successfully added to NetBox.")
-                        except pynetbox.core.query.RequestError as e:
-                            logger.exception(f"Failed to create interface template for {device['name']} at site {site}: {e}")
-
-        # Check for existing device
-        logger.debug(f"Checking if device already exists: {device['name']} (serial: {device['serial']})")
-        if nb.dcim.devices.get(site_id=site.id, serial=device["serial"]):
-            logger.info(f"Device {device['name']} with serial {device['serial']} already exists. Skipping...")
-            return
-
-        # Create NetBox Device
-        try:
-            device_data = {
-                    'name': device["name"],
-                    'device_type': nb_device_type.id,
-                    'tenant': tenant.id,
-                    'site': site.id,
-                    'serial': device["serial"]
-                }
-
-            logger.debug(f"Getting postable fields for NetBox API")
-            available_fields = get_postable_fields(netbox_url, netbox_token, 'dcim/devices')
-            logger.debug(f"Available NetBox API fields: {list(available_fields.keys())}")
-            if 'role' in available_fields:
-                logger.debug(f"Using 'role' field for device role (ID: {nb_device_role.id})")
-                device_data['role'] = nb_device_role.id
-            elif 'device_role' in available_fields:
-                logger.debug(f"Using 'device_role' field for device role (ID: {nb_device_role.id})")
-                device_data['device_role'] = nb_device_role.id
-            else:
-                logger.error(f'Could not determine the syntax for the role. Skipping device {device_name}, '
-                                f'{serial}.')
+                logger.error("Failed to create device type for %s at site %s: %s", device['name'], site, e)
                 return None
+            # Create all interface templates of the device type with a single request
+            templates_data = [{
+                "device_type": nb_device_type.id,
+                "name": port["name"],
+                "type": "1000base-t",
+            } for port in device.get("port_table", []) if port["media"] == "GE"]
+            if templates_data:
+                try:
+                    templates = nb.dcim.interface_templates.create(templates_data)
+                    for template in templates:
+                        logger.info("Interface template %s with ID %s successfully added to NetBox.", template.name, template.id)
+                except pynetbox.core.query.RequestError as e:
+                    logger.exception("Failed to create interface templates for %s at site %s: %s", device['name'], site, e)
 
-            # Add the device to Netbox
-            logger.debug(f"Creating device in NetBox with data: {device_data}")
-            nb_device = nb.dcim.devices.create(device_data)
+        if nb_device_type:
+            _device_types[key] = nb_device_type
+        return nb_device_type
 
-            if nb_device:
-                logger.info(f"Device {device['name']} serial {device['serial']} with ID {nb_device.id} successfully added to NetBox.")
-        except pynetbox.core.query.RequestError as e:
-            error_message = str(e)
-            if "Device name must be unique per site" in error_message:
-                logger.warning(f"Device name {device['name']} already exists at site {site}. "
-                               f"Trying with name {device['name']}_{device['serial']}.")
-                try:
-                    # Just update the name in the existing device_data dictionary
-                    device_data['name'] = f"{device['name']}_{device['serial']}"
-                    
-                    # Add the device to Netbox with updated name
-                    nb_device = nb.dcim.devices.create(device_data)
-                    if nb_device:
-                        logger.info(f"Device {device['name']} with ID {nb_device.id} successfully added to NetBox.")
-                except pynetbox.core.query.RequestError as e2:
-                    logger.exception(f"Failed to create device {device['name']} serial {device['serial']} at site {site}: {e2}")
-                    return
+def prepare_device(unifi, nb, site, device, context, site_lookups):
+    """
+    Prepare a device for NetBox.
+
+    Skips devices that already exist, resolves (or creates) the device type and works out the
+    primary IP of the device. The device itself is not created here; the returned payload is
+    created in bulk by create_site_devices().
+
+    :return: A dictionary with the UniFi device, the NetBox device payload and the primary IP
+             (or None if the IP cannot be determined), or None if the device should be skipped.
+    """
+    try:
+        logger.info("Processing device %s at site %s...", device['name'], site)
+        logger.debug("Device details: Model=%s, MAC=%s, IP=%s, Serial=%s", device.get('model'), device.get('mac'), device.get('ip'), device.get('serial'))
+
+        # Determine device role
+        if str(device.get("is_access_point", "false")).lower() == "true":
+            nb_device_role = context.wireless_role
+        else:
+            nb_device_role = context.lan_role
+
+        if not device.get("serial"):
+            logger.warning("Missing serial number for device %s. Skipping...", device.get('name'))
+            return None
+
+        # Check for existing device first, most devices already exist on a re-run
+        logger.debug("Checking if device already exists: %s (serial: %s)", device['name'], device['serial'])
+        if device["serial"] in site_lookups["serials"]:
+            logger.info("Device %s with serial %s already exists. Skipping...", device['name'], device['serial'])
+            return None
+
+        nb_device_type = get_device_type(nb, device, site)
+        if not nb_device_type:
+            return None
+
+        device_data = {
+                'name': device["name"],
+                'device_type': nb_device_type.id,
+                'tenant': context.tenant.id,
+                'site': site.id,
+                'serial': device["serial"]
+            }
+        logger.debug("Using '%s' field for device role (ID: %s)", context.role_field, nb_device_role.id)
+        device_data[context.role_field] = nb_device_role.id
+
+        # Work out the primary IP, the device is still added to NetBox without one
+        ip = None
+        device_ip = None
+        if not device.get("ip"):
+            logger.warning("No IP for device %s, adding it without a primary IP.", device['name'])
+        else:
+            try:
+                device_ip = _parse_ip(device["ip"])
+            except ValueError:
+                logger.warning("Invalid IP %s for device %s. Skipping...", device['ip'], device['name'])
+        if device_ip:
+            # get the prefix that this IP address belongs to
+            network = find_prefix_for_ip(device_ip, site_lookups["prefixes"])
+            if network:
+                ip = f'{device["ip"]}/{network.prefixlen}'
             else:
-                logger.exception(f"Failed to create device {device['name']} serial {device['serial']} at site {site}: {e}")
-                return
+                logger.warning("No prefix found for IP %s for device %s. Skipping...", device['ip'], device['name'])
 
-        # Add primary IP if available
-        try:
-            ipaddress.ip_address(device["ip"])
-        except ValueError:
-            logger.warning(f"Invalid IP {device['ip']} for device {device['name']}. Skipping...")
-            return
-        # get the prefix that this IP address belongs to
-        prefixes = nb.ipam.prefixes.filter(contains=device['ip'], vrf_id=vrf.id)
-        if not prefixes:
-            logger.warning(f"No prefix found for IP {device['ip']} for device {device['name']}. Skipping...")
-            return
-        for prefix in prefixes:
-            # Extract the prefix length (mask) from the prefix
-            subnet_mask = prefix.prefix.split('/')[1]
-            ip = f'{device["ip"]}/{subnet_mask}'
-            break
+        return {"device": device, "data": device_data, "ip": ip}
+
+    except Exception as e:
+        logger.exception("Failed to process device %s at site %s: %s", device['name'], site, e)
+        return None
+
+def create_device(nb, site, device, device_data):
+    """
+    Create a single device in NetBox, retrying with the serial appended to the name if the name is taken.
+
+    :return: The created NetBox device, or None if it could not be created.
+    """
+    try:
+        logger.debug("Creating device in NetBox with data: %s", device_data)
+        nb_device = nb.dcim.devices.create(device_data)
         if nb_device:
-            interface = nb.dcim.interfaces.get(device_id=nb_device.id, name="vlan.1")
-            if not interface:
-                try:
-                    interface = nb.dcim.interfaces.create(device=nb_device.id,
-                                                          name="vlan.1",
-                                                          type="virtual",
-                                                          enabled=True,
-                                                          vrf_id=vrf.id,)
-                    if interface:
-                        logger.info(
-                            f"Interface vlan.1 for device {device['name']} with ID {interface.id} successfully added to NetBox.")
-                except pynetbox.core.query.RequestError as e:
-                    logger.exception(
-                        f"Failed to create interface vlan.1 for device {device['name']} at site {site}: {e}")
-                    return
-            nb_ip = nb.ipam.ip_addresses.get(address=ip, vrf_id=vrf.id, tenant_id=tenant.id)
-            if not nb_ip:
-                try:
-                    nb_ip = nb.ipam.ip_addresses.create({
-                        "assigned_object_id": interface.id,
-                        "assigned_object_type": 'dcim.interface',
-                        "address": ip,
-                        "vrf_id": vrf.id,
-                        "tenant_id": tenant.id,
-                        "status": "active",
-                    })
-                    if nb_ip:
-                        logger.info(f"IP address {ip} with ID {nb_ip.id} successfully added to NetBox.")
-                except pynetbox.core.query.RequestError as e:
-                    logger.exception(f"Failed to create IP address {ip} for device {device['name']} at site {site}: {e}")
-                    return
+            logger.info("Device %s serial %s with ID %s successfully added to NetBox.", device['name'], device['serial'], nb_device.id)
+        return nb_device
+    except pynetbox.core.query.RequestError as e:
+        error_message = str(e)
+        if "Device name must be unique per site" in error_message:
+            logger.warning("Device name %s already exists at site %s. "
+                           "Trying with name %s_%s.", device['name'], site, device['name'], device['serial'])
+            try:
+                # Just update the name in the existing device_data dictionary
+                device_data['name'] = f"{device['name']}_{device['serial']}"
+
+                # Add the device to Netbox with updated name
+                nb_device = nb.dcim.devices.create(device_data)
+                if nb_device:
+                    logger.info("Device %s with ID %s successfully added to NetBox.", device['name'], nb_device.id)
+                return nb_device
+            except pynetbox.core.query.RequestError as e2:
+                logger.exception("Failed to create device %s serial %s at site %s: %s", device['name'], device['serial'], site, e2)
+                return None
+        else:
+            logger.exception("Failed to create device %s serial %s at site %s: %s", device['name'], device['serial'], site, e)
+            return None
+
+def create_interface(nb, site, device, nb_device, vrf):
+    """
+    Get or create the vlan.1 interface of a single device in NetBox.
+
+    :return: The NetBox interface, or None if it could not be created.
+    """
+    interface = nb.dcim.interfaces.get(device_id=nb_device.id, name="vlan.1")
+    if interface:
+        return interface
+    try:
+        interface = nb.dcim.interfaces.create(device=nb_device.id,
+                                              name="vlan.1",
+                                              type="virtual",
+                                              enabled=True,
+                                              vrf_id=vrf.id,)
+        if interface:
+            logger.info(
+                "Interface vlan.1 for device %s with ID %s successfully added to NetBox.", device['name'], interface.id)
+        return interface
+    except pynetbox.core.query.RequestError as e:
+        logger.exception(
+            "Failed to create interface vlan.1 for device %s at site %s: %s", device['name'], site, e)
+        return None
+
+def create_ip_address(nb, site, device, ip_data):
+    """
+    Create a single IP address in NetBox.
+
+    :return: The created NetBox IP address, or None if it could not be created.
+    """
+    try:
+        nb_ip = nb.ipam.ip_addresses.create(ip_data)
+        if nb_ip:
+            logger.info("IP address %s with ID %s successfully added to NetBox.", ip_data['address'], nb_ip.id)
+        return nb_ip
+    except pynetbox.core.query.RequestError as e:
+        logger.exception("Failed to create IP address %s for device %s at site %s: %s", ip_data['address'], device['name'], site, e)
+        return None
+
+def create_site_devices(nb, site, pending, site_lookups, tenant):
+    """
+    Create the prepared devices of a site in NetBox together with their vlan.1 interface and primary IP.
+
+    Devices, interfaces and IP addresses are each created with a single bulk request. NetBox rejects
+    a bulk request as a whole if any object in it is invalid, in which case the objects of that
+    request are created one by one instead so that one bad device does not block the others.
+
+    :param nb: pynetbox API instance.
+    :param site: NetBox site object.
+    :param pending: List of payloads returned by prepare_device().
+    :param site_lookups: Dictionary returned by load_site_lookups().
+    :param tenant: NetBox tenant object.
+    """
+    if not pending:
+        return
+    devices_endpoint = nb.dcim.devices
+    vrf = site_lookups["vrf"]
+
+    # Devices
+    try:
+        logger.debug("Creating %s devices at site %s in bulk", len(pending), site)
+        nb_devices = devices_endpoint.create([item["data"] for item in pending])
+        for item, nb_device in zip(pending, nb_devices):
+            logger.info("Device %s serial %s with ID %s successfully added to NetBox.", item['device']['name'], item['device']['serial'], nb_device.id)
+    except pynetbox.core.query.RequestError as e:
+        logger.warning("Bulk creation of devices at site %s failed, creating them one by one: %s", site, e)
+        nb_devices = [create_device(nb, site, item["device"], item["data"]) for item in pending]
+    created = [(item, nb_device) for item, nb_device in zip(pending, nb_devices) if nb_device and item["ip"]]
+    if not created:
+        return
+
+    # vlan.1 interfaces
+    try:
+        interfaces = nb.dcim.interfaces.create([{
+            "device": nb_device.id,
+            "name": "vlan.1",
+            "type": "virtual",
+            "enabled": True,
+            "vrf_id": vrf.id,
+        } for _, nb_device in created])
+        for (item, _), interface in zip(created, interfaces):
+            logger.info(
+                "Interface vlan.1 for device %s with ID %s successfully added to NetBox.", item['device']['name'], interface.id)
+    except pynetbox.core.query.RequestError as e:
+        logger.warning("Bulk creation of interfaces at site %s failed, creating them one by one: %s", site, e)
+        interfaces = [create_interface(nb, site, item["device"], nb_device, vrf) for item, nb_device in created]
+
+    # Primary IP addresses, reusing the ones that already exist
+    ip_payloads = []
+    for (item, nb_device), interface in zip(created, interfaces):
+        if interface and item["ip"] not in site_lookups["ip_addresses"]:
+            ip_payloads.append((item, {
+                "assigned_object_id": interface.id,
+                "assigned_object_type": 'dcim.interface',
+                "address": item["ip"],
+                "vrf_id": vrf.id,
+                "tenant_id": tenant.id,
+                "status": "active",
+            }))
+    if ip_payloads:
+        try:
+            nb_ips = nb.ipam.ip_addresses.create([ip_data for _, ip_data in ip_payloads])
+            for nb_ip in nb_ips:
+                logger.info("IP address %s with ID %s successfully added to NetBox.", nb_ip.address, nb_ip.id)
+        except pynetbox.core.query.RequestError as e:
+            logger.warning("Bulk creation of IP addresses at site %s failed, creating them one by one: %s", site, e)
+            nb_ips = [create_ip_address(nb, site, item["device"], ip_data) for item, ip_data in ip_payloads]
+        for (item, ip_data), nb_ip in zip(ip_payloads, nb_ips):
             if nb_ip:
+                site_lookups["ip_addresses"][item["ip"]] = nb_ip
+
+    # Primary IPs can only be set once the IP is assigned to an interface of the device, so they are
+    # set afterwards with a single bulk update instead of one PATCH per device
+    primary_ips = []
+    for (item, nb_device), interface in zip(created, interfaces):
+        nb_ip = site_lookups["ip_addresses"].get(item["ip"]) if interface else None
+        if nb_ip:
+            primary_ips.append((item, nb_device, nb_ip))
+    if not primary_ips:
+        return
+    try:
+        devices_endpoint.update([{"id": nb_device.id, "primary_ip4": nb_ip.id} for _, nb_device, nb_ip in primary_ips])
+    except pynetbox.core.query.RequestError as e:
+        logger.warning("Bulk update of primary IPs at site %s failed, updating them one by one: %s", site, e)
+        for item, nb_device, nb_ip in primary_ips:
+            try:
                 nb_device.primary_ip4 = nb_ip.id
                 nb_device.save()
-                logger.info(f"Device {device['name']} with IP {ip} added to NetBox.")
-
-    except Exception as e:
-        logger.exception(f"Failed to process device {device['name']} at site {site}: {e}")
+            except pynetbox.core.query.RequestError as e2:
+                logger.exception("Failed to set primary IP %s for device %s at site %s: %s",
+                                 item['ip'], item['device']['name'], site, e2)
+                continue
+            logger.info("Device %s with IP %s added to NetBox.", item['device']['name'], item['ip'])
+        return
+    for item, _, _ in primary_ips:
+        logger.info("Device %s with IP %s added to NetBox.", item['device']['name'], item['ip'])
 
-def process_site(unifi, nb, site_name, nb_site, nb_ubiquity, tenant):
+def process_site(unifi, nb, site_name, nb_site, context):
     """
     Process devices for a given site and add them to NetBox.
     """
-    logger.debug(f"Processing site {site_name}...")
+    logger.debug("Processing site %s...", site_name)
     try:
-        logger.debug(f"Fetching site object for: {site_name}")
+        logger.debug("Fetching site object for: %s", site_name)
         site = unifi.site(site_name)
         if site:
-            logger.debug(f"Fetching devices for site: {site_name}")
+            logger.debug("Fetching devices for site: %s", site_name)
             devices = site.device.all()
-            logger.debug(f"Found {len(devices)} devices for site {site_name}")
-
-            with ThreadPoolExecutor(max_workers=MAX_DEVICE_THREADS) as executor:
-                futures = []
-                for device in devices:
-                    futures.append(executor.submit(process_device, unifi, nb, nb_site, device, nb_ubiquity, tenant))
-
-                for future in as_completed(futures):
-                    try:
-                        future.result()
-                    except Exception as e:
-                        logger.error(f"Error processing a device at site {site_name}: {e}")
+            logger.debug("Found %s devices for site %s", len(devices), site_name)
+            if not devices:
+                logger.info("No devices found for site %s", site_name)
+                return
+
+            site_lookups = load_site_lookups(nb, nb_site, context.tenant, devices)
+            if not site_lookups:
+                logger.error("Could not get VRF for site %s. Skipping...", site_name)
+                return
+
+            # Preparing a device only needs the prefetched site lookups, so no worker threads are needed here
+            pending = []
+            for device in devices:
+                item = prepare_device(unifi, nb, nb_site, device, context, site_lookups)
+                if item:
+                    pending.append(item)
+
+            create_site_devices(nb, nb_site, pending, site_lookups, context.tenant)
         else:
-            logger.error(f"Site {site_name} not found")
+            logger.error("Site %s not found", site_name)
     except Exception as e:
-        logger.error(f"Failed to process site {site_name}: {e}")
+        logger.error("Failed to process site %s: %s", site_name, e)
 
-def process_controller(unifi_url, unifi_username, unifi_password, unifi_mfa_secret, nb, nb_ubiquity, tenant,
-                       netbox_sites_dict, config=None):
+def process_controller(unifi_url, unifi_username, unifi_password, unifi_mfa_secret, nb, context,
+                       netbox_sites_dict, site_mapping=None):
     """
     Process all sites and devices for a specific UniFi controller.
+
+    :return: True if the controller was processed, False if it failed (the error is logged).
     """
-    logger.info(f"Processing controller {unifi_url}...")
-    logger.debug(f"Initializing UniFi connection to: {unifi_url}")
+    logger.info("Processing controller %s...", unifi_url)
+    logger.debug("Initializing UniFi connection to: %s", unifi_url)
 
     try:
         # Create a Unifi instance and authenticate
         unifi = Unifi(unifi_url, unifi_username, unifi_password, unifi_mfa_secret)
-        logger.debug(f"UniFi connection established to: {unifi_url}")
+        logger.debug("UniFi connection established to: %s", unifi_url)
         
         # Get all sites from the controller
-        logger.debug(f"Fetching sites from controller: {unifi_url}")
+        logger.debug("Fetching sites from controller: %s", unifi_url)
         sites = unifi.sites
-        logger.debug(f"Found {len(sites)} sites on controller: {unifi_url}")
-        logger.info(f"Found {len(sites)} sites for controller {unifi_url}")
+        logger.debug("Found %s sites on controller: %s", len(sites), unifi_url)
+        logger.info("Found %s sites for controller %s", len(sites), unifi_url)
 
         with ThreadPoolExecutor(max_workers=MAX_SITE_THREADS) as executor:
             futures = []
             for site_name, site_obj in sites.items():
-                logger.info(f"Processing site {site_name}...")
-                nb_site = match_sites_to_netbox(site_name, netbox_sites_dict, config)
+                logger.info("Processing site %s...", site_name)
+                nb_site = match_sites_to_netbox(site_name, netbox_sites_dict, site_mapping)
 
                 if not nb_site:
-                    logger.warning(f"No match found for Ubiquity site: {site_name}. Skipping...")
+                    logger.warning("No match found for Ubiquity site: %s. Skipping...", site_name)
                     continue
 
-                futures.append(executor.submit(process_site, unifi, nb, site_name, nb_site, nb_ubiquity, tenant))
+                futures.append(executor.submit(process_site, unifi, nb, site_name, nb_site, context))
 
             # Wait for all site-processing threads to complete
             for future in as_completed(futures):
                 future.result()
     except Exception as e:
-        logger.error(f"Error processing controller {unifi_url}: {e}")
+        logger.error("Error processing controller %s: %s", unifi_url, e)
+        return False
+    return True
 
-def process_all_controllers(unifi_url_list, unifi_username, unifi_password, unifi_mfa_secret, nb, nb_ubiquity, tenant,
-                            netbox_sites_dict, config=None):
+def process_all_controllers(unifi_url_list, unifi_username, unifi_password, unifi_mfa_secret, nb, context,
+                            netbox_sites_dict, site_mapping=None):
     """
     Process all UniFi controllers in parallel.
+
+    Controllers are I/O bound, so they are processed in a thread pool bounded by
+    MAX_CONTROLLER_THREADS. Progress is logged as each controller finishes.
     """
-    with ThreadPoolExecutor(max_workers=MAX_CONTROLLER_THREADS) as executor:
-        futures = []
-        for url in unifi_url_list:
-            futures.append(
-                executor.submit(process_controller, url, unifi_username, unifi_password, unifi_mfa_secret, nb,
-                                nb_ubiquity, tenant, netbox_sites_dict, config))
+    if not unifi_url_list:
+        logger.warning("No UniFi controllers configured.")
+        return
+
+    total = len(unifi_url_list)
+    with ThreadPoolExecutor(max_workers=min(MAX_CONTROLLER_THREADS, total)) as executor:
+        futures = {
+            executor.submit(process_controller, url, unifi_username, unifi_password, unifi_mfa_secret, nb,
+                            context, netbox_sites_dict, site_mapping): url
+            for url in unifi_url_list
+        }
 
         # Wait for all controller-processing threads to complete
-        for future in as_completed(futures):
+        for done, future in enumerate(as_completed(futures), start=1):
+            url = futures[future]
             try:
-                future.result()
+                succeeded = future.result()
             except Exception as e:
-                logger.exception(f"Error processing one of the UniFi controllers {url}: {e}")
-                continue
+                logger.exception("Error processing UniFi controller %s: %s", url, e)
+                succeeded = False
+            if succeeded:
+                logger.info("Finished controller %s (%d/%d)", url, done, total)
+            else:
+                logger.warning("Controller %s failed (%d/%d)", url, done, total)
 
 def fetch_site_devices(unifi, site_name):
     """Fetch devices for a specific site."""
-    logger.info(f"Fetching devices for site {site_name}...")
+    logger.info("Fetching devices for site %s...", site_name)
     try:
-        logger.debug(f"Getting site object for: {site_name}")
+        logger.debug("Getting site object for: %s", site_name)
         site = unifi.site(site_name)
         if site:
-            logger.debug(f"Retrieving devices for site: {site_name}")
+            logger.debug("Retrieving devices for site: %s", site_name)
             devices = site.device.all()
-            logger.debug(f"Retrieved {len(devices)} devices for site: {site_name}")
+            logger.debug("Retrieved %s devices for site: %s", len(devices), site_name)
             return devices
         else:
-            logger.error(f"Site {site_name} not found")
+            logger.error("Site %s not found", site_name)
             return None
     except Exception as e:
-        logger.error(f"Failed to fetch devices for site {site_name}: {e}")
+        logger.error("Failed to fetch devices for site %s: %s", site_name, e)
         return None
 
-def process_all_sites(unifi, netbox_sites_dict, nb, nb_ubiquity, tenant):
+def process_all_sites(unifi, netbox_sites_dict, nb, context, site_mapping=None):
     """Process all sites and their devices concurrently."""
     # Get all sites from the unifi module
     unifi_sites = unifi.sites
@@ -517,39 +985,55 @@ def process_all_sites(unifi, netbox_sites_dict, nb, nb_ubiquity, tenant):
                 devices = future.result()
                 if devices:
                     sites[site_name] = devices
-                    logger.info(f"Successfully fetched devices for site {site_name}")
+                    logger.info("Successfully fetched devices for site %s", site_name)
             except Exception as e:
-                logger.error(f"Error fetching devices for site {site_name}: {e}")
+                logger.error("Error fetching devices for site %s: %s", site_name, e)
 
-    logger.info(f"Fetched {len(sites)} sites. Starting device processing...")
+    logger.info("Fetched %s sites. Starting device processing...", len(sites))
 
     # Process devices in parallel
+    site_batches = {}
     with ThreadPoolExecutor(max_workers=MAX_THREADS) as executor:
         future_to_device = {}
         for site_name, devices in sites.items():
             # Use the site mapping to find the corresponding NetBox site
-            nb_site = match_sites_to_netbox(site_name, netbox_sites_dict)
+            nb_site = match_sites_to_netbox(site_name, netbox_sites_dict, site_mapping)
             if not nb_site:
-                logger.warning(f"No matching NetBox site found for Ubiquity site {site_name}. Add mapping in site_mapping.yaml. Skipping...")
+                logger.warning("No matching NetBox site found for Ubiquity site %s. Add mapping in site_mapping.yaml. Skipping...", site_name)
+                continue
+            site_lookups = load_site_lookups(nb, nb_site, context.tenant, devices)
+            if not site_lookups:
+                logger.error("Could not get VRF for site %s. Skipping...", site_name)
                 continue
+            site_batches[site_name] = (nb_site, site_lookups, [])
             for device in devices:
-                future = executor.submit(process_device, unifi, nb, nb_site, device, nb_ubiquity, tenant)
+                future = executor.submit(prepare_device, unifi, nb, nb_site, device, context, site_lookups)
                 future_to_device[future] = (site_name, device)
 
         for future in as_completed(future_to_device):
             site_name, device = future_to_device[future]
             try:
-                future.result()
-                logger.info(f"Successfully processed device {device['name']} at site {site_name}.")
+                item = future.result()
+                if item:
+                    site_batches[site_name][2].append(item)
             except Exception as e:
-                logger.error(f"Error processing device {device['name']} at site {site_name}: {e}")
+                logger.error("Error processing device %s at site %s: %s", device['name'], site_name, e)
+
+    # Create the prepared devices in bulk, one batch per site
+    for site_name, (nb_site, site_lookups, pending) in site_batches.items():
+        create_site_devices(nb, nb_site, pending, site_lookups, context.tenant)
+        logger.info("Successfully processed %s new devices at site %s.", len(pending), site_name)
 
-def parse_successful_log_entries(log_file):
+def parse_successful_log_entries(log_file, chunk_size=1 << 20):
     """
     Parses a log file to find entries containing 'successfully added to NetBox'
     and builds a dictionary with 'device' and 'ip address' lists of IDs.
 
+    The file is read in chunks and scanned with a single regular expression, which keeps
+    large log files fast to parse without loading them into memory at once.
+
     :param log_file: Path to the log file
+    :param chunk_size: Number of characters to read at a time
     :return: Dictionary with lists of IDs for 'device' and 'ip address'
     """
     # Dictionary to store the resulting lists
@@ -558,41 +1042,49 @@ def parse_successful_log_entries(log_file):
         "ip address": []
     }
 
-    # Regular expression to extract the ID from the log entry
-    id_pattern_device = re.compile(r"^Device .* with ID (\d+) successfully added to NetBox")
-    id_pattern_ip = re.compile(r"^IP address .* with ID (\d+) successfully added to NetBox")
+    def collect(text):
+        for match in SUCCESS_LOG_PATTERN.finditer(text):
+            key = "device" if match.group(1) == "Device" else "ip address"
+            result[key].append(int(match.group(2)))
 
     with open(log_file, "r") as file:
-        for line in file:
-            # Start processing the log entry only after `INFO -`
-            if "INFO - " in line:
-                log_content = line.split("INFO - ", 1)[1]  # Extract the part after "INFO - "
-
-                # Match and classify the log entry
-                if match := id_pattern_device.match(log_content):
-                    result["device"].append(int(match.group(1)))  # Extract and add device ID
-                elif match := id_pattern_ip.match(log_content):
-                    result["ip address"].append(int(match.group(1)))  # Extract and add IP address ID
+        tail = ""
+        while chunk := file.read(chunk_size):
+            data = tail + chunk
+            # Only scan complete lines, the remainder is carried over to the next chunk
+            last_newline = data.rfind("\n")
+            if last_newline == -1:
+                tail = data
+                continue
+            collect(data[:last_newline + 1])
+            tail = data[last_newline + 1:]
+        collect(tail)
 
     return result
 
-
 if __name__ == "__main__":
     # Parse command line arguments
     import argparse
     parser = argparse.ArgumentParser(description='Sync UniFi devices to NetBox')
     parser.add_argument('-v', '--verbose', action='store_true', help='Enable verbose (debug) logging')
+    parser.add_argument('--refresh-cache', action='store_true',
+                        help='Fetch the NetBox sites from NetBox even if the local cache is still valid')
     args = parser.parse_args()
     
     # Configure logging with appropriate level based on verbose flag
     log_level = logging.DEBUG if args.verbose else logging.INFO
     setup_logging(log_level)
+
+    if os.getenv('UNIFI2NETBOX_PROFILE') == '1':
+        start_profiler()
     
     if args.verbose:
         logger.debug("Verbose logging enabled")
     logger.debug("Loading configuration")
     config = load_config()
     logger.debug("Configuration loaded successfully")
+    # Resolve the site mapping once instead of re-reading it for every site
+    site_mapping = load_site_mapping(config)
     try:
         unifi_url_list = config['UNIFI']['URLS']
     except ValueError:
@@ -619,29 +1111,35 @@ if __name__ == "__main__":
         logger.exception("Netbox token is missing from environment variables.")
         raise SystemExit(1)
 
-    # Create a custom HTTP session as this script will often exceed the default pool size of 10
+    # Create a custom HTTP session as this script will often exceed the default pool size of 10.
+    # A pool smaller than the number of worker threads makes urllib3 discard and re-open
+    # connections (with a fresh TLS handshake) whenever the workers overflow it.
     session = requests.Session()
-    adapter = requests.adapters.HTTPAdapter(pool_connections=50, pool_maxsize=50)
+    # Certificates are verified unless VERIFY_SSL is explicitly disabled, e.g. for a self-signed NetBox
+    session.verify = config['NETBOX'].get('VERIFY_SSL', True)
+    if not session.verify:
+        logger.warning("TLS certificate verification is disabled for NetBox at %s", netbox_url)
+    session.headers.update({"Accept": "application/json"})
+    # Rate limiting and transient gateway errors are retried with a short backoff instead of failing the device.
+    adapter = requests.adapters.HTTPAdapter(pool_connections=NETBOX_POOL_SIZE, pool_maxsize=NETBOX_POOL_SIZE,
+                                            max_retries=Retry(total=5, backoff_factor=0.3,
+                                                              status_forcelist=[429, 502, 503, 504]))
 
     # Adjust connection pool size
     session.mount("http://", adapter)
     session.mount("https://", adapter)
 
-    logger.debug(f"Initializing NetBox API connection to: {netbox_url}")
+    logger.debug("Initializing NetBox API connection to: %s", netbox_url)
     nb = pynetbox.api(netbox_url, token=netbox_token, threading=True)
-    nb.http_session.verify = False
-    nb.http_session = session  # Attach the custom session
+    nb.http_session = session  # Attach the custom session, shared by all worker threads
     logger.debug("NetBox API connection established")
 
-    nb_ubiquity = nb.dcim.manufacturers.get(slug='ubiquity')
     try:
         tenant_name = config['NETBOX']['TENANT']
     except ValueError:
         logger.exception("Netbox tenant is missing from configuration.")
         raise SystemExit(1)
 
-    tenant = nb.tenancy.tenants.get(name=tenant_name)
-
     try:
         wireless_role_name = config['NETBOX']['ROLES']['WIRELESS']
     except KeyError:
@@ -653,31 +1151,39 @@ if __name__ == "__main__":
         logger.exception("Netbox lan role is missing from configuration.")
         raise SystemExit(1)
 
-    wireless_role = nb.dcim.device_roles.get(slug=wireless_role_name.lower())
-    lan_role = nb.dcim.device_roles.get(slug=lan_role_name.lower())
-    if not wireless_role:
-        wireless_role = nb.dcim.device_roles.create({'name': wireless_role_name, 'slug': wireless_role_name.lower()})
-        if wireless_role:
-            logger.info(f"Wireless role {wireless_role_name} with ID {wireless_role.id} successfully added to Netbox.")
-    if not lan_role:
-        lan_role = nb.dcim.device_roles.create({'name': lan_role_name, 'slug': lan_role_name.lower()})
-        if lan_role:
-            logger.info(f"LAN role {lan_role_name} with ID {lan_role.id} successfully added to Netbox.")
+    # The startup lookups do not depend on each other, so run them concurrently
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        logger.debug("Getting postable fields for NetBox API")
+        fields_future = executor.submit(get_postable_fields, session, netbox_url, netbox_token, 'dcim/devices')
+        tenant_future = executor.submit(nb.tenancy.tenants.get, name=tenant_name)
+        roles_future = executor.submit(get_or_create_device_roles, nb, [wireless_role_name, lan_role_name])
+        sites_future = executor.submit(load_sites_cached, nb, refresh=args.refresh_cache)
+
+    # The device schema is static for the run, so resolve the role field name only once
+    available_fields = fields_future.result()
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Available NetBox API fields: %s", list(available_fields.keys()))
+    if 'role' in available_fields:
+        role_field = 'role'
+    elif 'device_role' in available_fields:
+        role_field = 'device_role'
+    else:
+        logger.error("Could not determine the syntax for the device role from the NetBox API.")
+        raise SystemExit(1)
 
-    logger.debug("Fetching all NetBox sites")
-    netbox_sites = nb.dcim.sites.all()
-    logger.debug(f"Found {len(netbox_sites)} sites in NetBox")
+    tenant = tenant_future.result()
+    roles = roles_future.result()
+    wireless_role = roles[wireless_role_name]
+    lan_role = roles[lan_role_name]
+
+    netbox_sites = sites_future.result()
 
     # Preprocess NetBox sites
     logger.debug("Preparing NetBox sites dictionary")
     netbox_sites_dict = prepare_netbox_sites(netbox_sites)
-    logger.debug(f"Prepared {len(netbox_sites_dict)} NetBox sites for mapping")
-
-    if not nb_ubiquity:
-        nb_ubiquity = nb.dcim.manufacturers.create({'name': 'Ubiquity Networks', 'slug': 'ubiquity'})
-        if nb_ubiquity:
-            logger.info(f"Ubiquity manufacturer with ID {nb_ubiquity.id} successfully added to Netbox.")
+    logger.debug("Prepared %s NetBox sites for mapping", len(netbox_sites_dict))
 
     # Process all UniFi controllers in parallel
-    process_all_controllers(unifi_url_list, unifi_username, unifi_password, unifi_mfa_secret, nb, nb_ubiquity,
-                            tenant, netbox_sites_dict, config)
+    context = NetBoxContext(wireless_role=wireless_role, lan_role=lan_role, tenant=tenant, role_field=role_field)
+    process_all_controllers(unifi_url_list, unifi_username, unifi_password, unifi_mfa_secret, nb, context,
+                            netbox_sites_dict, site_mapping)
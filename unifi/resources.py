@@ -119,13 +119,10 @@ class BaseResource:
             url = f"{self.api_path}/{site_name}/{self.endpoint}"
         logger.debug(f"Constructed URL for all items: {url}")
         logger.debug(f"Making API request to get all items from: {url}")
-        all_items = self.unifi.make_request(url, 'GET')
-        if not all_items:
+        response = self.unifi.make_request(url, 'GET')
+        if not response:
             logger.error(f'Could not get data for {self.endpoint}.')
             return []
-        if isinstance(all_items, list):
-            logger.debug(f"Retrieved {len(all_items)} items from {self.endpoint}")
-        response = self.unifi.make_request(url, 'GET')
         if response.get("meta", {}).get('rc') == 'ok':
             items = response.get('data', [])
             logger.debug(f"Retrieved {len(items)} items from {self.endpoint}")
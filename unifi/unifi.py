@@ -33,6 +33,7 @@ class Unifi:
     :ivar udm_pro: Specific path for UDM-Pro; initialized as an empty string
     :ivar session_cookie: Cookie for managing UniFi sessions, initializes as None
     :ivar csrf_token: CSRF token for API requests, initializes as None
+    :ivar session: HTTP session shared by all API requests so connections to the controller are reused
     :type base_url: str
     :type username: str
     :type password: str
@@ -40,6 +41,7 @@ class Unifi:
     :type udm_pro: str
     :type session_cookie: Optional[str]
     :type csrf_token: Optional[str]
+    :type session: requests.Session
     """
     SESSION_FILE = os.path.expanduser("~/.unifi_session.json")
     _session_data = {}  # Class-level session storage by base_url
@@ -53,6 +55,9 @@ class Unifi:
         self.udm_pro = ''
         self.session_cookie = None
         self.csrf_token = None
+        # Keep-alive session for API requests, instead of a new connection (and TLS handshake) per request
+        self.session = requests.Session()
+        self.session.verify = False
 
         if not all([self.base_url, self.username, self.password, self.mfa_secret]):
             logger.error("Missing required parameters for UniFi connection")
@@ -198,16 +203,16 @@ class Unifi:
         try:
             if method.upper() == "GET":
                 logger.debug(f"Sending GET request to {url}")
-                response = requests.get(url, headers=headers, cookies=cookies, verify=False)
+                response = self.session.get(url, headers=headers, cookies=cookies, verify=False)
             elif method.upper() == "POST":
                 logger.debug(f"Sending POST request to {url} with data")
-                response = requests.post(url, json=data, headers=headers, cookies=cookies, verify=False)
+                response = self.session.post(url, json=data, headers=headers, cookies=cookies, verify=False)
             elif method.upper() == "PUT":
                 logger.debug(f"Sending PUT request to {url} with data")
-                response = requests.put(url, json=data, headers=headers, cookies=cookies, verify=False)
+                response = self.session.put(url, json=data, headers=headers, cookies=cookies, verify=False)
             elif method.upper() == "DELETE":
                 logger.debug(f"Sending DELETE request to {url}")
-                response = requests.delete(url, headers=headers, cookies=cookies, verify=False)
+                response = self.session.delete(url, headers=headers, cookies=cookies, verify=False)
             else:
                 logger.error(f"Unsupported HTTP method: {method}")
                 raise ValueError(f"Unsupported HTTP method: {method}")